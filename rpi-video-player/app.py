@@ -1,19 +1,50 @@
 import os
+import sys
+import time
+import atexit
+import asyncio
 import subprocess
-import json
-from flask import Flask, request, jsonify, render_template, send_from_directory
+import shutil
+import tempfile
+import threading
+import orjson
+from quart import Quart, request, jsonify, render_template
+from quart.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
 import logging
 
+# Development mode (auto-reload, debug logging) is opt-in with DEBUG=1
+DEBUG = os.environ.get('DEBUG') == '1'
+
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO)
+
+class OrjsonProvider(DefaultJSONProvider):
+    # orjson encodes straight to bytes, skipping the str round trip the default
+    # provider does for every response (the status poll included).
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-app = Flask(__name__)
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype=self.mimetype)
+
+app = Quart(__name__)
+app.json = OrjsonProvider(app)
 
 VIDEO_DIR = 'videos'
 PLAYLIST_FILE = 'playlist.json'
 # Use an absolute path for the black screen video
 BLACK_SCREEN_VIDEO = os.path.abspath('black.mp4') 
+BLACK_SCREEN_NAME = os.path.basename(BLACK_SCREEN_VIDEO)
+# Reported as currentVideo while the black screen is up; shared, never mutated
+BLACK_SCREEN_STATUS = {'name': 'Black Screen', 'filename': BLACK_SCREEN_NAME}
+# omxplayer render layers: the looping black screen stays up underneath content
+BLACK_SCREEN_LAYER = '1'
+CONTENT_LAYER = '2'
 # Ensure the black.mp4 file exists or create a dummy one
 if not os.path.exists(BLACK_SCREEN_VIDEO):
     try:
@@ -29,65 +60,280 @@ if not os.path.exists(BLACK_SCREEN_VIDEO):
 
 app.config['UPLOAD_FOLDER'] = VIDEO_DIR
 app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # 1GB Max Upload Size
+app.config['BODY_TIMEOUT'] = 30 * 60  # Large uploads over Wi-Fi can take well over Quart's 60s default
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 86400  # Let browsers cache /static assets for a day
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 if not os.path.exists(VIDEO_DIR):
     os.makedirs(VIDEO_DIR)
 
 omxplayer_process = None
-
-def get_playlist():
+# Cleared by watch_content_player as soon as the tracked player exits
+_player_alive = False
+# Serializes everything that starts or stops players or moves current_playing_index,
+# so auto-advance never races a next/previous/stop request. Callers of
+# stop_omxplayer, play_video_omx and show_black_screen hold it.
+playback_lock = asyncio.Lock()
+# Strong references to fire-and-forget tasks so they aren't garbage collected
+_background_tasks = set()
+# Long-lived `omxplayer --loop` on the black screen, paused while content plays
+black_screen_process = None
+black_screen_paused = False
+# What is on screen, recorded by play_video_omx / show_black_screen
+current_is_black_screen = False
+current_playing_filename = None
+
+# Parsed playlist.json, kept in memory so polling endpoints don't hit the SD card.
+# Only save_playlist replaces it, so the cache is coherent with every write.
+_PLAYLIST_CACHE = None
+# filename -> entry for the cached playlist, in playlist order
+_PLAYLIST_INDEX = {}
+_PLAYLIST_LOCK = threading.Lock()
+# Set by save_playlist; the writer thread flushes the cache to disk after
+# PLAYLIST_FLUSH_DELAY so a burst of drag-and-drop reorders costs one write.
+_PLAYLIST_DIRTY = threading.Event()
+_PLAYLIST_WRITE_LOCK = threading.Lock()
+PLAYLIST_FLUSH_DELAY = 0.25  # seconds
+PLAYLIST_RETRY_DELAY = 5  # seconds, after a failed write
+
+def playlist_entry(filename):
+    # Only the filename is stored on disk; path and display name derive from it
+    stem, _, _ = filename.rpartition('.')
+    return {'filename': filename, 'path': os.path.join(VIDEO_DIR, filename), 'name': stem or filename}
+
+def _load_playlist():
     if not os.path.exists(PLAYLIST_FILE):
         return []
     try:
-        with open(PLAYLIST_FILE, 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
+        with open(PLAYLIST_FILE, 'rb') as f:
+            filenames = orjson.loads(f.read())
+    except orjson.JSONDecodeError as e:
+        logging.error(f"{PLAYLIST_FILE} is corrupt ({e}), starting with an empty playlist.")
         return []
+    if filenames and isinstance(filenames[0], dict):
+        # Old format stored whole entries; rewrite it as filenames on the next flush
+        filenames = [video['filename'] for video in filenames]
+        _PLAYLIST_DIRTY.set()
+    return [playlist_entry(filename) for filename in filenames]
 
-def save_playlist(playlist):
-    with open(PLAYLIST_FILE, 'w') as f:
-        json.dump(playlist, f)
+def get_playlist():
+    # The returned list is the cache itself: build a new list and pass it to
+    # save_playlist rather than mutating it in place.
+    global _PLAYLIST_CACHE, _PLAYLIST_INDEX
+    if _PLAYLIST_CACHE is not None:
+        return _PLAYLIST_CACHE
+    with _PLAYLIST_LOCK:
+        if _PLAYLIST_CACHE is None:
+            _PLAYLIST_CACHE = _load_playlist()
+            _PLAYLIST_INDEX = {video['filename']: video for video in _PLAYLIST_CACHE}
+        return _PLAYLIST_CACHE
+
+def get_playlist_index():
+    # Same read-only contract as get_playlist
+    get_playlist()
+    return _PLAYLIST_INDEX
 
-def stop_omxplayer():
-    global omxplayer_process
-    if omxplayer_process and omxplayer_process.poll() is None:
+def save_playlist(playlist):
+    global _PLAYLIST_CACHE, _PLAYLIST_INDEX
+    with _PLAYLIST_LOCK:
+        _PLAYLIST_CACHE = list(playlist)
+        _PLAYLIST_INDEX = {video['filename']: video for video in _PLAYLIST_CACHE}
+    _PLAYLIST_DIRTY.set()
+
+def flush_playlist():
+    # Only one flush touches the temp file at a time; the cache lock is held just
+    # long enough to snapshot it, so request handlers never wait on the SD card.
+    with _PLAYLIST_WRITE_LOCK:
+        with _PLAYLIST_LOCK:
+            if not _PLAYLIST_DIRTY.is_set():
+                return
+            data = orjson.dumps([video['filename'] for video in _PLAYLIST_CACHE])
+            _PLAYLIST_DIRTY.clear()
+        # Write to a temp file and rename so readers never see a half-written file.
+        # The fsync matters on the Pi: without it a power cut after the rename can
+        # leave an empty playlist.json on ext4.
+        tmp_file = PLAYLIST_FILE + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, PLAYLIST_FILE)
+        except Exception:
+            # Leave the change pending so the writer retries it (e.g. after ENOSPC)
+            _PLAYLIST_DIRTY.set()
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+def _playlist_writer():
+    while True:
+        _PLAYLIST_DIRTY.wait()
+        time.sleep(PLAYLIST_FLUSH_DELAY) # Let further updates in the burst land first
         try:
-            omxplayer_process.stdin.write(b'q')
-            omxplayer_process.stdin.flush()
-            omxplayer_process.wait(timeout=5)
-            logging.info("OMXPlayer process stopped via 'q'.")
-        except (subprocess.TimeoutExpired, OSError, ValueError) as e:
-            logging.warning(f"Failed to stop OMXPlayer gracefully with 'q': {e}. Terminating.")
+            flush_playlist()
+        except Exception as e:
+            # Not just OSError: if this thread dies, no later change is ever persisted
+            logging.error(f"Failed to write {PLAYLIST_FILE}: {e}. Retrying in {PLAYLIST_RETRY_DELAY}s.")
+            time.sleep(PLAYLIST_RETRY_DELAY) # Don't spin on a full or failing SD card
+
+threading.Thread(target=_playlist_writer, name='playlist-writer', daemon=True).start()
+# Don't lose an update still inside the coalescing window on shutdown
+atexit.register(flush_playlist)
+
+# Filenames present in VIDEO_DIR, re-listed only when the directory's mtime changes.
+# Creating, renaming or removing an entry bumps the mtime, so uploads and deletes
+# invalidate it without any bookkeeping.
+_videos_mtime = None
+_existing_set = set()
+# The mtime only advances at the filesystem's timestamp granularity (a scheduler
+# tick on ext4, 2 s on FAT), so a change landing in the same tick as a listing
+# leaves it untouched. A listing is only cached once its mtime is older than this.
+VIDEO_DIR_MTIME_SLACK_NS = 2_000_000_000
+
+def get_existing_videos():
+    global _videos_mtime, _existing_set
+    mtime = os.stat(VIDEO_DIR).st_mtime_ns
+    if mtime != _videos_mtime:
+        # DirEntry.is_file() uses the type from the directory read itself, so
+        # this is one getdents pass with no per-file stat
+        with os.scandir(VIDEO_DIR) as entries:
+            _existing_set = {entry.name for entry in entries if entry.is_file()}
+        # Right after a change, keep re-listing until a further change in the same
+        # tick can no longer go unnoticed
+        _videos_mtime = mtime if time.time_ns() - mtime > VIDEO_DIR_MTIME_SLACK_NS else None
+    return _existing_set
+
+@app.before_serving
+async def use_pidfd_child_watcher():
+    # Before Python 3.12, asyncio reaps every child from its own thread blocked in
+    # waitpid(). With pidfds (Linux 5.3+) the event loop polls the process fd instead,
+    # so the kernel wakes us exactly when omxplayer exits. 3.12+ does this by default.
+    if sys.version_info >= (3, 12) or not hasattr(os, 'pidfd_open'):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError as e:
+        logging.info(f"pidfd_open unavailable ({e}), keeping the default child watcher.")
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(asyncio.get_running_loop())
+    asyncio.set_child_watcher(watcher)
+
+async def pkill_players(layer):
+    # Match on the render layer so content and black screen players are cleaned up separately.
+    try:
+        pkill = await asyncio.create_subprocess_exec('pkill', '-f', f'omxplayer.bin .*--layer {layer} ')
+        await asyncio.wait_for(pkill.wait(), timeout=5)
+        logging.info(f"Attempted pkill of layer {layer} omxplayer.bin as a fallback.")
+    except (asyncio.TimeoutError, FileNotFoundError) as e:
+        logging.warning(f"pkill of layer {layer} omxplayer.bin failed: {e}")
+
+async def stop_player(proc):
+    # Returns True when 'q' didn't work and the process had to be signalled:
+    # signalling the omxplayer wrapper script can orphan omxplayer.bin, so the
+    # caller should pkill the player's layer afterwards.
+    try:
+        proc.stdin.write(b'q')
+        await proc.stdin.drain()
+        await asyncio.wait_for(proc.wait(), timeout=5)
+        logging.info(f"OMXPlayer PID {proc.pid} stopped via 'q'.")
+        return False
+    except (asyncio.TimeoutError, OSError, ValueError) as e:
+        logging.warning(f"Failed to stop OMXPlayer PID {proc.pid} gracefully with 'q': {e}. Terminating.")
+        try:
+            proc.terminate()
+            await asyncio.wait_for(proc.wait(), timeout=5)
+        except (asyncio.TimeoutError, OSError) as e2:
+            logging.error(f"Failed to terminate OMXPlayer PID {proc.pid}: {e2}. Killing.")
+            proc.kill()
             try:
-                omxplayer_process.terminate()
-                omxplayer_process.wait(timeout=5)
-            except (subprocess.TimeoutExpired, OSError) as e2:
-                logging.error(f"Failed to terminate OMXPlayer: {e2}. Killing.")
-                omxplayer_process.kill()
-                omxplayer_process.wait(timeout=5) # Wait for kill
+                await asyncio.wait_for(proc.wait(), timeout=5) # Wait for kill
+            except asyncio.TimeoutError:
+                logging.error(f"OMXPlayer PID {proc.pid} did not exit after kill.")
+        return True
+
+async def stop_omxplayer():
+    global omxplayer_process, _player_alive
+    needs_pkill_fallback = False
+    if omxplayer_process and omxplayer_process.returncode is None:
+        try:
+            needs_pkill_fallback = await stop_player(omxplayer_process)
         finally:
             omxplayer_process = None
-    # Fallback: Ensure no lingering omxplayer instances if our tracking failed
-    try:
-        subprocess.run(['pkill', 'omxplayer.bin'], timeout=5)
-        logging.info("Attempted pkill omxplayer.bin as a fallback.")
-    except (subprocess.TimeoutExpired, FileNotFoundError) as e:
-        logging.warning(f"pkill omxplayer.bin failed: {e}")
-
-
-def play_video_omx(video_path):
-    global omxplayer_process
-    stop_omxplayer() # Ensure any existing instance is stopped
+            _player_alive = False
+    # Fallback: Ensure no lingering omxplayer instances if stopping our tracked one failed
+    if needs_pkill_fallback:
+        await pkill_players(CONTENT_LAYER)
+
+
+async def watch_content_player(proc):
+    # The child watcher wakes this task when the player exits, so status requests
+    # read a flag instead of checking on the process themselves, and a video that
+    # finishes on its own moves on to the next one without a client round trip.
+    global _player_alive
+    await proc.wait()
+    async with playback_lock:
+        if proc is not omxplayer_process:
+            return # Stopped or replaced through the API
+        _player_alive = False
+        logging.info(f"OMXPlayer PID {proc.pid} exited with code {proc.returncode}.")
+        await play_next_after_exit(proc)
+
+
+async def play_next_after_exit(proc):
+    global current_playing_index
+    if proc.returncode != 0:
+        # Don't spin through the playlist respawning a player that keeps failing
+        logging.warning(f"OMXPlayer failed on {current_playing_filename}. Not advancing the playlist.")
+        await show_black_screen()
+        return
+    playlist = get_playlist()
+    # Look the finished video up by name: the playlist may have been reordered or
+    # had entries deleted while it played
+    finished_index = next((i for i, video in enumerate(playlist) if video['filename'] == current_playing_filename), -1)
+    if finished_index == -1:
+        logging.info(f"{current_playing_filename} left the playlist while playing. Stopping on black screen.")
+        current_playing_index = -1
+        await show_black_screen()
+        return
+    current_playing_index = (finished_index + 1) % len(playlist)
+    video_path = os.path.join(VIDEO_DIR, playlist[current_playing_index]['filename'])
+    if os.path.exists(video_path):
+        logging.info(f"Auto-advancing to video: {video_path} at index {current_playing_index}")
+        await play_video_omx(video_path)
+    else:
+        logging.warning(f"Next video file {video_path} not found. Stopping on black screen.")
+        await show_black_screen()
+
+
+async def play_video_omx(video_path):
+    global omxplayer_process, _player_alive, current_is_black_screen, current_playing_filename
+    await stop_omxplayer() # Ensure any existing instance is stopped
+    current_is_black_screen = False
+    current_playing_filename = None
+    # The black screen keeps running on a lower layer; pause it so it isn't
+    # decoding underneath the content.
+    await set_black_screen_paused(True)
     try:
         # Output to framebuffer, adjust --display and other params as needed for SPI
         # Common options: -o hdmi, -o local, --display <n> (for specific displays)
         # For SPI displays often mapped to /dev/fb0 or similar, -o fbdev might be needed
         # or just letting omxplayer pick the default framebuffer if configured system-wide.
         # Adding --no-osd to hide on-screen display, --no-keys to disable keyboard control.
-        command = ['omxplayer', '--no-osd', '--no-keys', video_path]
+        command = ['omxplayer', '--no-osd', '--no-keys', '--layer', CONTENT_LAYER, video_path]
         logging.info(f"Executing OMXPlayer command: {' '.join(command)}")
-        omxplayer_process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        # Discard omxplayer's console output: an inherited terminal or pipe that nobody
+        # reads (or that has gone away) can otherwise stall playback on a blocked write.
+        omxplayer_process = await asyncio.create_subprocess_exec(
+            *command, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
         logging.info(f"OMXPlayer started for video: {video_path} with PID: {omxplayer_process.pid}")
+        current_playing_filename = os.path.basename(video_path)
+        _player_alive = True
+        watcher = asyncio.create_task(watch_content_player(omxplayer_process))
+        _background_tasks.add(watcher)
+        watcher.add_done_callback(_background_tasks.discard)
     except FileNotFoundError:
         logging.error("OMXPlayer command not found. Is it installed and in PATH?")
     except Exception as e:
@@ -95,21 +341,128 @@ def play_video_omx(video_path):
         omxplayer_process = None
 
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+async def start_black_screen():
+    global black_screen_process, black_screen_paused
+    try:
+        command = ['omxplayer', '--no-osd', '--no-keys', '--loop', '--layer', BLACK_SCREEN_LAYER, BLACK_SCREEN_VIDEO]
+        logging.info(f"Executing OMXPlayer command: {' '.join(command)}")
+        black_screen_process = await asyncio.create_subprocess_exec(
+            *command, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        black_screen_paused = False
+        logging.info(f"Black screen OMXPlayer started with PID: {black_screen_process.pid}")
+    except FileNotFoundError:
+        logging.error("OMXPlayer command not found. Is it installed and in PATH?")
+        black_screen_process = None
+    except Exception as e:
+        logging.error(f"Error starting black screen OMXPlayer: {e}")
+        black_screen_process = None
 
-@app.route('/static/<path:path>')
-def send_static(path):
-    return send_from_directory('static', path)
+
+async def set_black_screen_paused(paused):
+    global black_screen_paused
+    if not black_screen_process or black_screen_process.returncode is not None or black_screen_paused == paused:
+        return
+    try:
+        black_screen_process.stdin.write(b'p') # 'p' toggles pause in omxplayer
+        await black_screen_process.stdin.drain()
+        black_screen_paused = paused
+    except OSError as e:
+        logging.warning(f"Failed to toggle pause on black screen OMXPlayer: {e}")
+
+
+async def show_black_screen():
+    # Stop content and resume the black screen player, starting it only if it
+    # isn't running yet (first use, or it died).
+    global current_is_black_screen, current_playing_filename
+    await stop_omxplayer()
+    current_playing_filename = None
+    if black_screen_process and black_screen_process.returncode is None:
+        await set_black_screen_paused(False)
+    else:
+        await start_black_screen()
+    current_is_black_screen = black_screen_process is not None
+
+
+async def stop_black_screen():
+    global black_screen_process, current_is_black_screen
+    needs_pkill_fallback = False
+    if black_screen_process and black_screen_process.returncode is None:
+        try:
+            needs_pkill_fallback = await stop_player(black_screen_process)
+        finally:
+            black_screen_process = None
+            current_is_black_screen = False
+    if needs_pkill_fallback:
+        await pkill_players(BLACK_SCREEN_LAYER)
+
+
+@app.before_serving
+async def start_on_black_screen():
+    # Clear players left over from a previous run of the app, including a looping
+    # black screen that would otherwise stack up under the new one
+    await pkill_players(CONTENT_LAYER)
+    await pkill_players(BLACK_SCREEN_LAYER)
+    if os.path.exists(BLACK_SCREEN_VIDEO):
+        async with playback_lock:
+            await show_black_screen()
+
+
+@app.after_serving
+async def stop_players():
+    async def stop_content():
+        async with playback_lock:
+            await stop_omxplayer()
+    # Independent processes, so stop both at once to keep shutdown within one ladder
+    await asyncio.gather(stop_content(), stop_black_screen())
+
+
+def save_upload(stream, filepath):
+    # Runs in a worker thread. The form parser spools each part to a
+    # SpooledTemporaryFile: large uploads roll over to a temp file, so sendfile() can
+    # copy them kernel-side, while small ones stay in memory and go through
+    # copyfileobj. Writing to a .part file and renaming it keeps half-written
+    # videos out of VIDEO_DIR if the copy fails or the Pi loses power.
+    # Each upload gets its own .part file, so two uploads of the same name never
+    # write into one inode; the last rename wins with a complete file.
+    dst, part_path = tempfile.mkstemp(suffix='.part', prefix=os.path.basename(filepath) + '.',
+                                      dir=os.path.dirname(filepath))
+    try:
+        os.fchmod(dst, 0o644) # mkstemp creates it 0600
+        if isinstance(stream, tempfile.SpooledTemporaryFile) and not stream._rolled:
+            src_fd = None # fileno() would roll it over, writing it to disk first
+        else:
+            try:
+                src_fd = stream.fileno()
+            except (AttributeError, OSError):
+                src_fd = None
+        if src_fd is not None:
+            offset = stream.tell()
+            while sent := os.sendfile(dst, src_fd, offset, UPLOAD_CHUNK_SIZE):
+                offset += sent
+        else:
+            with os.fdopen(dst, 'wb', closefd=False) as out:
+                shutil.copyfileobj(stream, out, UPLOAD_CHUNK_SIZE)
+        os.close(dst)
+    except Exception:
+        os.close(dst)
+        os.remove(part_path)
+        raise
+    os.replace(part_path, filepath)
+
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
 
 @app.route('/api/videos', methods=['GET'])
-def list_videos_endpoint():
+async def list_videos_endpoint():
     playlist = get_playlist()
+    existing_videos = get_existing_videos()
     # Ensure videos in playlist still exist
     valid_playlist = []
     for video_info in playlist:
-        if os.path.exists(os.path.join(VIDEO_DIR, video_info['filename'])):
+        if video_info['filename'] in existing_videos:
             valid_playlist.append(video_info)
         else:
             logging.warning(f"Video {video_info['filename']} not found, removing from playlist.")
@@ -118,22 +471,26 @@ def list_videos_endpoint():
     return jsonify(valid_playlist)
 
 @app.route('/api/videos/upload', methods=['POST'])
-def upload_video_endpoint():
-    if 'video' not in request.files:
+async def upload_video_endpoint():
+    files = await request.files
+    if 'video' not in files:
         return jsonify({'error': 'No video file part'}), 400
-    file = request.files['video']
+    file = files['video']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     if file:
         filename = secure_filename(file.filename)
+        # Reject duplicates by filename before copying the upload into VIDEO_DIR. By now
+        # the body is already spooled to a temporary file, so this saves the second
+        # write of up to 1GB, not the receive itself.
+        if filename in get_playlist_index():
+            return jsonify({'error': f'Video {filename} is already in the playlist'}), 409
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         try:
-            file.save(filepath)
-            playlist = get_playlist()
-            # Avoid adding duplicates by filename
-            if not any(v['filename'] == filename for v in playlist):
-                playlist.append({'filename': filename, 'path': filepath, 'name': filename.rsplit('.', 1)[0]})
-                save_playlist(playlist)
+            await asyncio.to_thread(save_upload, file.stream, filepath)
+            # Re-check: a concurrent upload of the same name may have finished first
+            if filename not in get_playlist_index():
+                save_playlist(get_playlist() + [playlist_entry(filename)])
             return jsonify({'message': 'Video uploaded successfully', 'filename': filename}), 201
         except Exception as e:
             logging.error(f"Error saving uploaded file {filename}: {e}")
@@ -141,36 +498,37 @@ def upload_video_endpoint():
     return jsonify({'error': 'File upload failed'}), 500
 
 
+def remove_from_playlist(filename):
+    # Caller holds playback_lock. Keeps current_playing_index on the same video
+    # when an earlier entry goes, and resets it when the entry itself goes.
+    global current_playing_index
+    if filename not in get_playlist_index():
+        return
+    playlist = get_playlist()
+    position = next(i for i, video in enumerate(playlist) if video['filename'] == filename)
+    save_playlist(playlist[:position] + playlist[position + 1:])
+    if position < current_playing_index:
+        current_playing_index -= 1
+    elif position == current_playing_index:
+        current_playing_index = -1
+
+
 @app.route('/api/videos/<filename>', methods=['DELETE'])
-def delete_video_endpoint(filename):
+async def delete_video_endpoint(filename):
     filepath = os.path.join(VIDEO_DIR, filename)
-    playlist = get_playlist()
     
     # If the video being deleted is currently playing, stop playback.
-    global omxplayer_process
-    if omxplayer_process and omxplayer_process.poll() is None:
-        # This is a simplification. Ideally, you'd check if omxplayer_process.args contains filename
-        # For now, we'll assume if a video is playing and we delete *any* video, we should stop.
-        # A more precise check would involve storing the currently playing video's filename.
-        current_video_path_playing = None # Placeholder for actual check
-        # A simple check could be if omxplayer_process.args contains the filepath.
-        # This requires storing more info about the process or parsing args.
-        # For now, let's assume if we delete a video, and something is playing, we stop it.
-        # This is not ideal if deleting a non-playing video while another is playing.
-        # A better approach: store the filename of the video passed to play_video_omx
-        # and compare it here.
-        # For this example, we'll stop if *any* video is playing and *any* video is deleted.
-        # This needs refinement for a production system.
-        logging.info(f"Video {filename} is being deleted. Stopping current playback if any.")
-        stop_omxplayer()
-        play_video_omx(BLACK_SCREEN_VIDEO) # Show black screen after deleting active video
+    async with playback_lock:
+        if _player_alive and current_playing_filename == filename:
+            logging.info(f"Video {filename} is being deleted while playing. Stopping playback.")
+            await show_black_screen() # Show black screen after deleting active video
 
 
     if os.path.exists(filepath):
         try:
-            os.remove(filepath)
-            playlist = [video for video in playlist if video['filename'] != filename]
-            save_playlist(playlist)
+            await asyncio.to_thread(os.remove, filepath)
+            async with playback_lock:
+                remove_from_playlist(filename)
             return jsonify({'message': 'Video deleted successfully'}), 200
         except Exception as e:
             logging.error(f"Error deleting video file {filename}: {e}")
@@ -178,87 +536,80 @@ def delete_video_endpoint(filename):
     return jsonify({'error': 'Video not found'}), 404
 
 @app.route('/api/playlist/reorder', methods=['POST'])
-def reorder_playlist_endpoint():
-    new_order = request.json.get('playlist')
+async def reorder_playlist_endpoint():
+    global current_playing_index
+    data = await request.get_json(silent=True)
+    new_order = data.get('playlist') if isinstance(data, dict) else None
     if new_order is None:
         return jsonify({'error': 'Playlist data missing'}), 400
+    if not isinstance(new_order, list) or not all(isinstance(filename, str) for filename in new_order):
+        return jsonify({'error': 'Playlist must be a list of filenames'}), 400
     
-    current_playlist = get_playlist()
-    # Create a dictionary for quick lookup of current video details
-    current_playlist_dict = {video['filename']: video for video in current_playlist}
-    
-    reordered_playlist = []
-    valid_filenames = set(current_playlist_dict.keys())
-
-    for filename_in_new_order in new_order:
-        if filename_in_new_order in valid_filenames:
-            # Preserve existing details, only update order
-            reordered_playlist.append(current_playlist_dict[filename_in_new_order])
-        else:
-            logging.warning(f"Filename {filename_in_new_order} in reorder request not found in current playlist. Skipping.")
-
-    # Ensure all original videos are present, in case new_order is partial (though it shouldn't be)
-    # This step might be redundant if the frontend sends the full, reordered list of existing filenames.
-    # For robustness, we ensure we don't lose videos if the client sends a malformed list.
-    if len(reordered_playlist) != len(current_playlist_dict):
-        logging.warning("Reordered playlist length mismatch. Reconstructing carefully.")
-        # This part needs careful handling. If the client is trusted to send the full list,
-        # then simply saving `reordered_playlist` (after validation) is fine.
-        # If not, you might need a more complex merge or reject the request.
-        # For now, we'll trust the client sends a list of existing filenames.
-        pass # Assuming client sends a full list of existing filenames in new order.
-
-    save_playlist(reordered_playlist)
+    async with playback_lock:
+        current_playlist_dict = get_playlist_index()
+        # The client must send every current filename exactly once; anything else
+        # (partial, duplicated or stale list) is rejected rather than guessed at.
+        if len(new_order) != len(current_playlist_dict) or set(new_order) != current_playlist_dict.keys():
+            logging.warning("Reorder request doesn't match the current playlist. Rejecting.")
+            return jsonify({'error': 'Reordered playlist must contain exactly the current videos'}), 400
+
+        # Re-point the index at the same video in its new position
+        playlist = get_playlist()
+        if 0 <= current_playing_index < len(playlist):
+            current_playing_index = new_order.index(playlist[current_playing_index]['filename'])
+        # Preserve existing details, only update order
+        save_playlist([current_playlist_dict[filename] for filename in new_order])
     return jsonify({'message': 'Playlist reordered successfully'}), 200
 
 current_playing_index = -1
 
 @app.route('/api/playback/play', methods=['POST'])
-def play_video_endpoint():
+async def play_video_endpoint():
     global current_playing_index
     playlist = get_playlist()
     if not playlist:
         return jsonify({'error': 'Playlist is empty'}), 400
 
-    video_filename_to_play = request.json.get('filename')
+    video_filename_to_play = (await request.get_json()).get('filename')
     
-    if video_filename_to_play:
-        # Find the index of the requested video
-        found_index = -1
-        for i, video_info in enumerate(playlist):
-            if video_info['filename'] == video_filename_to_play:
-                found_index = i
-                break
-        if found_index != -1:
-            current_playing_index = found_index
+    async with playback_lock:
+        if video_filename_to_play:
+            # Find the index of the requested video
+            found_index = -1
+            for i, video_info in enumerate(playlist):
+                if video_info['filename'] == video_filename_to_play:
+                    found_index = i
+                    break
+            if found_index != -1:
+                current_playing_index = found_index
+            else:
+                return jsonify({'error': f'Video {video_filename_to_play} not in playlist'}), 404
         else:
-            return jsonify({'error': f'Video {video_filename_to_play} not in playlist'}), 404
-    else:
-        # If no specific filename, play from the start or current/next
-        if current_playing_index == -1 or current_playing_index >= len(playlist) -1: # Start from beginning if at end or never played
-             current_playing_index = 0
-        # If a video was playing, and "play" is hit again, it might mean resume or restart current.
-        # For simplicity, we'll just play the video at current_playing_index.
-        # OMXPlayer itself doesn't have a simple "resume" from a stopped state via new command.
-        # Pause/Resume is handled differently.
-
-    video_to_play = playlist[current_playing_index]
-    video_path = os.path.join(VIDEO_DIR, video_to_play['filename'])
-    
-    if os.path.exists(video_path):
-        logging.info(f"Playing video: {video_path} at index {current_playing_index}")
-        play_video_omx(video_path)
-        return jsonify({'message': f'Playing {video_to_play["name"]}', 'playing': video_to_play, 'currentIndex': current_playing_index}), 200
+            # If no specific filename, play from the start or current/next
+            if current_playing_index == -1 or current_playing_index >= len(playlist) -1: # Start from beginning if at end or never played
+                 current_playing_index = 0
+            # If a video was playing, and "play" is hit again, it might mean resume or restart current.
+            # For simplicity, we'll just play the video at current_playing_index.
+            # OMXPlayer itself doesn't have a simple "resume" from a stopped state via new command.
+            # Pause/Resume is handled differently.
+
+        video_to_play = playlist[current_playing_index]
+        video_path = os.path.join(VIDEO_DIR, video_to_play['filename'])
+        
+        if os.path.exists(video_path):
+            logging.info(f"Playing video: {video_path} at index {current_playing_index}")
+            await play_video_omx(video_path)
+            return jsonify({'message': f'Playing {video_to_play["name"]}', 'playing': video_to_play, 'currentIndex': current_playing_index}), 200
     return jsonify({'error': 'Video file not found'}), 404
 
 
 @app.route('/api/playback/pause', methods=['POST'])
-def pause_video_endpoint():
+async def pause_video_endpoint():
     global omxplayer_process
-    if omxplayer_process and omxplayer_process.poll() is None:
+    if omxplayer_process and omxplayer_process.returncode is None:
         try:
             omxplayer_process.stdin.write(b'p') # 'p' toggles pause in omxplayer
-            omxplayer_process.stdin.flush()
+            await omxplayer_process.stdin.drain()
             return jsonify({'message': 'Playback pause/resume toggled'}), 200
         except Exception as e:
             logging.error(f"Error sending pause command to OMXPlayer: {e}")
@@ -266,88 +617,75 @@ def pause_video_endpoint():
     return jsonify({'error': 'OMXPlayer not running or already stopped'}), 400
 
 @app.route('/api/playback/stop', methods=['POST'])
-def stop_video_endpoint():
+async def stop_video_endpoint():
     global current_playing_index
     logging.info("Stop command received. Stopping OMXPlayer and displaying black screen.")
-    stop_omxplayer()
-    # Play a black screen video
-    if os.path.exists(BLACK_SCREEN_VIDEO):
-        logging.info(f"Playing black screen video: {BLACK_SCREEN_VIDEO}")
-        play_video_omx(BLACK_SCREEN_VIDEO) # Play the black screen
-    else:
-        # Fallback if black.mp4 is missing - just ensure player is stopped.
-        # The framebuffer might retain the last frame or go blank depending on system config.
-        logging.warning(f"Black screen video not found at {BLACK_SCREEN_VIDEO}. OMXPlayer stopped, but screen might not be black.")
-    current_playing_index = -1 # Reset playlist position
+    async with playback_lock:
+        if os.path.exists(BLACK_SCREEN_VIDEO):
+            # Resumes the already-running black screen player instead of spawning a new one
+            await show_black_screen()
+        else:
+            await stop_omxplayer()
+            # Fallback if black.mp4 is missing - just ensure player is stopped.
+            # The framebuffer might retain the last frame or go blank depending on system config.
+            logging.warning(f"Black screen video not found at {BLACK_SCREEN_VIDEO}. OMXPlayer stopped, but screen might not be black.")
+        current_playing_index = -1 # Reset playlist position
     return jsonify({'message': 'Playback stopped, displaying black screen.'}), 200
 
 @app.route('/api/playback/next', methods=['POST'])
-def next_video_endpoint():
+async def next_video_endpoint():
     global current_playing_index
     playlist = get_playlist()
     if not playlist:
         return jsonify({'error': 'Playlist is empty'}), 400
     
-    current_playing_index += 1
-    if current_playing_index >= len(playlist):
-        current_playing_index = 0 # Loop back to the start
-        
-    video_to_play = playlist[current_playing_index]
-    video_path = os.path.join(VIDEO_DIR, video_to_play['filename'])
-    if os.path.exists(video_path):
-        logging.info(f"Playing next video: {video_path} at index {current_playing_index}")
-        play_video_omx(video_path)
-        return jsonify({'message': f'Playing next: {video_to_play["name"]}', 'playing': video_to_play, 'currentIndex': current_playing_index}), 200
+    async with playback_lock:
+        current_playing_index += 1
+        if current_playing_index >= len(playlist):
+            current_playing_index = 0 # Loop back to the start
+            
+        video_to_play = playlist[current_playing_index]
+        video_path = os.path.join(VIDEO_DIR, video_to_play['filename'])
+        if os.path.exists(video_path):
+            logging.info(f"Playing next video: {video_path} at index {current_playing_index}")
+            await play_video_omx(video_path)
+            return jsonify({'message': f'Playing next: {video_to_play["name"]}', 'playing': video_to_play, 'currentIndex': current_playing_index}), 200
     return jsonify({'error': 'Next video file not found'}), 404
 
 
 @app.route('/api/playback/previous', methods=['POST'])
-def previous_video_endpoint():
+async def previous_video_endpoint():
     global current_playing_index
     playlist = get_playlist()
     if not playlist:
         return jsonify({'error': 'Playlist is empty'}), 400
         
-    current_playing_index -= 1
-    if current_playing_index < 0:
-        current_playing_index = len(playlist) - 1 # Loop back to the end
-        
-    video_to_play = playlist[current_playing_index]
-    video_path = os.path.join(VIDEO_DIR, video_to_play['filename'])
-    if os.path.exists(video_path):
-        logging.info(f"Playing previous video: {video_path} at index {current_playing_index}")
-        play_video_omx(video_path)
-        return jsonify({'message': f'Playing previous: {video_to_play["name"]}', 'playing': video_to_play, 'currentIndex': current_playing_index}), 200
+    async with playback_lock:
+        current_playing_index -= 1
+        if current_playing_index < 0:
+            current_playing_index = len(playlist) - 1 # Loop back to the end
+            
+        video_to_play = playlist[current_playing_index]
+        video_path = os.path.join(VIDEO_DIR, video_to_play['filename'])
+        if os.path.exists(video_path):
+            logging.info(f"Playing previous video: {video_path} at index {current_playing_index}")
+            await play_video_omx(video_path)
+            return jsonify({'message': f'Playing previous: {video_to_play["name"]}', 'playing': video_to_play, 'currentIndex': current_playing_index}), 200
     return jsonify({'error': 'Previous video file not found'}), 404
 
 @app.route('/api/playback/status', methods=['GET'])
-def playback_status_endpoint():
+async def playback_status_endpoint():
     global omxplayer_process, current_playing_index
     playlist = get_playlist()
     status = {'isPlaying': False, 'currentVideo': None, 'currentIndex': current_playing_index}
 
-    if omxplayer_process and omxplayer_process.poll() is None:
-        # Check if it's the black screen video
-        # This check is a bit naive as it relies on the exact path.
-        # A more robust way would be to store a flag or the specific filename when black screen is played.
-        is_black_screen = False
-        try:
-            # omxplayer_process.args might not be directly accessible or could be complex.
-            # A common way to get command args for a PID on Linux:
-            with open(f'/proc/{omxplayer_process.pid}/cmdline', 'r') as f:
-                cmdline = f.read().split(' ')
-            if BLACK_SCREEN_VIDEO in cmdline:
-                is_black_screen = True
-        except Exception as e:
-            logging.debug(f"Could not check /proc/{omxplayer_process.pid}/cmdline for black screen: {e}")
-
-
-        if not is_black_screen and 0 <= current_playing_index < len(playlist):
+    if current_is_black_screen and black_screen_process and black_screen_process.returncode is None:
+        status['isPlaying'] = True # Technically playing, but it's the black screen
+        status['currentVideo'] = BLACK_SCREEN_STATUS
+    elif _player_alive:
+        if 0 <= current_playing_index < len(playlist):
             status['isPlaying'] = True
             status['currentVideo'] = playlist[current_playing_index]
-        elif is_black_screen:
-            status['isPlaying'] = True # Technically playing, but it's the black screen
-            status['currentVideo'] = {'name': 'Black Screen', 'filename': os.path.basename(BLACK_SCREEN_VIDEO)}
         # If omxplayer is running but current_playing_index is out of sync,
         # it implies an inconsistency or that omxplayer was started externally/manually.
         # For now, we trust current_playing_index if the process is alive and not black screen.
@@ -361,4 +699,12 @@ if __name__ == '__main__':
         logging.error(f"CRITICAL: Black screen video {BLACK_SCREEN_VIDEO} does not exist. Stopping playback will not show a black screen.")
         # Optionally, exit if black.mp4 is critical and missing
         # exit(1) 
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development entry point; production runs under gunicorn with gunicorn.conf.py.
+    # A single worker is required: playback state (omxplayer_process,
+    # current_playing_index) lives in this process.
+    import uvicorn
+    # The reloader needs an import string, but without it that string would import
+    # this file a second time as 'app' (a second playlist writer, atexit hook and
+    # ffmpeg check), so hand over the already-loaded object instead.
+    uvicorn.run('app:app' if DEBUG else app, host='0.0.0.0', port=5000, workers=1, reload=DEBUG,
+                log_level='debug' if DEBUG else 'info')
@@ -0,0 +1,19 @@
+# Production server config, used as:
+#   gunicorn -c gunicorn.conf.py app:app
+# Run it behind nginx (see README.md) so large uploads are buffered by the
+# proxy instead of being trickled into the worker over a slow Wi-Fi link.
+
+bind = '127.0.0.1:5000'
+
+# Exactly one worker: the omxplayer processes, the playlist cache and the
+# playback position all live in the worker process. Concurrent requests are
+# handled by the worker's event loop, not by extra workers or threads.
+workers = 1
+worker_class = 'uvicorn_worker.UvicornWorker'
+
+# No max_requests: recycling the worker would stop whatever is playing.
+# Shutdown stops both players at once, each taking up to 20 s (q, terminate
+# and kill at 5 s apiece, then a pkill), and the content player may first wait
+# for a play request that is stopping the previous video the same way. Leave
+# room for that so the worker isn't killed mid-cleanup, leaking omxplayer.bin.
+graceful_timeout = 45